@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Os scripts de tools/ são executados diretamente e importam uns aos outros pelo nome
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "tools"))
@@ -0,0 +1,78 @@
+from pathlib import Path
+
+from ispc_artifacts import ArtifactManifest, code_sha256
+
+
+def _run(manifest_path: Path, script: Path, out: Path, inputs: dict) -> bool:
+    manifest = ArtifactManifest(manifest_path)
+    full_inputs = {**inputs, "code": code_sha256(script)}
+    ran = manifest.run("stage", full_inputs, [out], lambda: out.write_text("x", encoding="utf-8"))
+    manifest.save()
+    return ran
+
+
+def test_stage_skipped_when_nothing_changes(tmp_path: Path) -> None:
+    script = tmp_path / "script.py"
+    script.write_text("FEATURES = ['a', 'b']\n", encoding="utf-8")
+    out = tmp_path / "out.txt"
+    manifest_path = tmp_path / "manifest.json"
+
+    assert _run(manifest_path, script, out, {"threshold": 0.85})
+    assert not _run(manifest_path, script, out, {"threshold": 0.85})
+
+
+def test_stage_stale_when_module_constant_changes(tmp_path: Path) -> None:
+    script = tmp_path / "script.py"
+    script.write_text("FEATURES = ['a', 'b']\n", encoding="utf-8")
+    out = tmp_path / "out.txt"
+    manifest_path = tmp_path / "manifest.json"
+
+    assert _run(manifest_path, script, out, {})
+    script.write_text("FEATURES = ['a']\n", encoding="utf-8")
+    assert _run(manifest_path, script, out, {})
+
+
+def test_stage_stale_when_input_or_output_changes(tmp_path: Path) -> None:
+    script = tmp_path / "script.py"
+    script.write_text("", encoding="utf-8")
+    out = tmp_path / "out.txt"
+    manifest_path = tmp_path / "manifest.json"
+
+    assert _run(manifest_path, script, out, {"threshold": 0.85})
+    assert _run(manifest_path, script, out, {"threshold": 0.80})
+
+    out.write_text("editado", encoding="utf-8")
+    assert _run(manifest_path, script, out, {"threshold": 0.80})
+
+    out.unlink()
+    assert _run(manifest_path, script, out, {"threshold": 0.80})
+
+
+def test_force_reruns_fresh_stage(tmp_path: Path) -> None:
+    script = tmp_path / "script.py"
+    script.write_text("", encoding="utf-8")
+    out = tmp_path / "out.txt"
+    manifest_path = tmp_path / "manifest.json"
+
+    assert _run(manifest_path, script, out, {})
+    manifest = ArtifactManifest(manifest_path, force=True)
+    assert manifest.run("stage", {"code": code_sha256(script)}, [out], lambda: out.write_text("x", encoding="utf-8"))
+
+
+def test_corrupt_manifest_marks_stage_stale(tmp_path: Path) -> None:
+    script = tmp_path / "script.py"
+    script.write_text("", encoding="utf-8")
+    out = tmp_path / "out.txt"
+    out.write_text("x", encoding="utf-8")
+    manifest_path = tmp_path / "manifest.json"
+
+    for content in ['{"stages": {', '{"kind": "outro", "stages": {}}', "[]"]:
+        manifest_path.write_text(content, encoding="utf-8")
+        assert _run(manifest_path, script, out, {})
+
+    manifest_path.write_text('{"stages": {', encoding="utf-8")
+    manifest = ArtifactManifest(manifest_path, force=True)
+    assert manifest.run("stage", {"code": code_sha256(script)}, [out], lambda: out.write_text("x", encoding="utf-8"))
+    manifest.save()
+    assert not _run(manifest_path, script, out, {})
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
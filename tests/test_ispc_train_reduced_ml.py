@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+from ispc_train_reduced_ml import (
+    REQUIRED_INPUTS_10,
+    _fold_ids_from_splits,
+    _group_fold_ids,
+    _kfold_indices,
+    _predict,
+    _r2,
+    _ridge_cv_scores,
+    _ridge_fit,
+    _rmse,
+    train_one_target,
+)
+
+
+ALPHAS = [0.0, 0.01, 0.1, 1.0, 10.0]
+
+
+def _data(n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 10))
+    y = X @ rng.normal(size=10) + rng.normal(size=n)
+    return X, y
+
+
+def _refit(X: np.ndarray, y: np.ndarray, fold_ids: np.ndarray, alpha: float) -> np.ndarray:
+    yhat = np.empty_like(y)
+    for f in np.unique(fold_ids):
+        test = fold_ids == f
+        intercept, weights = _ridge_fit(X[~test], y[~test], alpha=alpha)
+        yhat[test] = _predict(X[test], intercept, weights)
+    return yhat
+
+
+def test_grouped_cv_matches_explicit_per_group_refit() -> None:
+    X, y = _data(240)
+    groups = np.random.default_rng(1).integers(0, 30, size=240)
+    fold_ids = _group_fold_ids(groups)
+
+    scores = _ridge_cv_scores(X, y, fold_ids, ALPHAS, pooled=True)
+    for alpha, score in zip(ALPHAS, scores):
+        yhat = _refit(X, y, fold_ids, alpha)
+        assert score is not None
+        assert np.isclose(score[0], _rmse(y, yhat), rtol=1e-10)
+        assert np.isclose(score[1], _r2(y, yhat), rtol=1e-10)
+
+
+def test_kfold_cv_matches_explicit_per_fold_refit() -> None:
+    X, y = _data(108)
+    splits = _kfold_indices(108, k=5, seed=42)
+    fold_ids = _fold_ids_from_splits(108, splits)
+
+    scores = _ridge_cv_scores(X, y, fold_ids, ALPHAS)
+    for alpha, score in zip(ALPHAS, scores):
+        rmses, r2s = [], []
+        for train_idx, test_idx in splits:
+            intercept, weights = _ridge_fit(X[train_idx], y[train_idx], alpha=alpha)
+            yhat = _predict(X[test_idx], intercept, weights)
+            rmses.append(_rmse(y[test_idx], yhat))
+            r2s.append(_r2(y[test_idx], yhat))
+        assert score is not None
+        assert np.isclose(score[0], np.mean(rmses), rtol=1e-10)
+        assert np.isclose(score[1], np.mean(r2s), rtol=1e-10)
+
+
+def test_single_row_groups_do_not_inflate_r2() -> None:
+    rng = np.random.default_rng(2)
+    X = rng.normal(size=(200, 10))
+    y = rng.normal(size=200)
+    fold_ids = _group_fold_ids(np.arange(200))
+
+    for score in _ridge_cv_scores(X, y, fold_ids, ALPHAS, pooled=True):
+        assert score is not None
+        assert score[1] < 0.5
+
+
+def test_alpha_zero_skipped_when_training_fold_too_small() -> None:
+    X, y = _data(40)
+    groups = np.where(np.arange(40) < 35, 0, 1)
+
+    scores = _ridge_cv_scores(X, y, _group_fold_ids(groups), ALPHAS, pooled=True)
+    assert scores[0] is None
+    assert all(s is not None for s in scores[1:])
+
+
+def _frame(n: int) -> pd.DataFrame:
+    X, y = _data(n, seed=3)
+    df = pd.DataFrame(X, columns=REQUIRED_INPUTS_10)
+    df["dmp"] = y
+    df["parcela"] = [f"P{i % 6}" for i in range(n)]
+    return df
+
+
+def test_unlabeled_rows_are_not_a_group() -> None:
+    df = _frame(60)
+    df.loc[:9, "parcela"] = np.nan
+    df.loc[10:14, "parcela"] = " "
+
+    model = train_one_target(df, REQUIRED_INPUTS_10, "dmp", ALPHAS, k=5, seed=42, group_col="parcela")
+    assert model["ok"]
+    assert model["cv"]["k"] == 6
+    assert model["cv"]["n_unlabeled"] == 15
+    assert model["n"] == 60
+
+
+def test_grouped_cv_ignores_k_for_row_minimum() -> None:
+    df = _frame(30)
+
+    model = train_one_target(df, REQUIRED_INPUTS_10, "dmp", ALPHAS, k=50, seed=42, group_col="parcela")
+    assert model["ok"]
+    assert model["cv"]["scheme"] == "group"
+
+
+def test_all_unlabeled_is_not_enough_groups() -> None:
+    df = _frame(30)
+    df["parcela"] = np.nan
+
+    model = train_one_target(df, REQUIRED_INPUTS_10, "dmp", ALPHAS, k=5, seed=42, group_col="parcela")
+    assert not model["ok"]
+    assert model["reason"] == "not_enough_groups"
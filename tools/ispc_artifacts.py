@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+
+MANIFEST_NAME = "ispc_manifest.json"
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_sha256(script: Path) -> str:
+    # Hash do script inteiro (funções e constantes de módulo) e deste módulo;
+    # qualquer edição no código invalida os estágios que ele produz.
+    h = hashlib.sha256()
+    for path in (Path(script), Path(__file__)):
+        h.update(file_sha256(path).encode("ascii"))
+    return h.hexdigest()
+
+
+def fingerprint(inputs: dict) -> str:
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ArtifactManifest:
+    """Grafo de artefatos endereçado por conteúdo.
+
+    Cada estágio declara suas entradas (hash do código, argumentos relevantes,
+    hashes dos artefatos de origem) e seus arquivos de saída. Um estágio só é
+    recalculado quando as entradas mudam ou alguma saída foi alterada/removida;
+    caso contrário, as saídas ficam intactas (byte a byte).
+    """
+
+    def __init__(self, path: Path, force: bool = False) -> None:
+        self.path = Path(path)
+        self.force = force
+        # Com --force o manifesto nem é lido: serve de recuperação quando ele
+        # estiver corrompido.
+        self.stages: dict[str, dict] = {} if force else self._load()
+        self.ran: list[tuple[str, float]] = []
+        self.skipped: list[tuple[str, float]] = []
+
+    def _load(self) -> dict[str, dict]:
+        # Manifesto ilegível ou de outro formato: todos os estágios ficam desatualizados
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("kind") != "ispc_artifact_manifest":
+            return {}
+        stages = data.get("stages")
+        if not isinstance(stages, dict):
+            return {}
+        return {name: entry for name, entry in stages.items() if isinstance(entry, dict)}
+
+    def is_fresh(self, name: str, inputs: dict, outputs: list[Path]) -> bool:
+        if self.force:
+            return False
+        entry = self.stages.get(name)
+        if entry is None or entry.get("key") != fingerprint(inputs):
+            return False
+        recorded = entry.get("outputs", {})
+        if sorted(recorded) != sorted(p.as_posix() for p in outputs):
+            return False
+        for p in outputs:
+            if not p.exists() or file_sha256(p) != recorded[p.as_posix()]:
+                return False
+        return True
+
+    def run(self, name: str, inputs: dict, outputs: list[Path], build: Callable[[], None]) -> bool:
+        """Executa `build` se o estágio estiver desatualizado. Retorna True se executou."""
+        if self.is_fresh(name, inputs, outputs):
+            self.skipped.append((name, float(self.stages[name].get("seconds", 0.0))))
+            return False
+
+        t0 = time.perf_counter()
+        build()
+        seconds = time.perf_counter() - t0
+
+        self.stages[name] = {
+            "key": fingerprint(inputs),
+            "inputs": inputs,
+            "outputs": {p.as_posix(): file_sha256(p) for p in outputs},
+            "seconds": round(seconds, 6),
+        }
+        self.ran.append((name, seconds))
+        return True
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"kind": "ispc_artifact_manifest", "stages": self.stages}
+        text = json.dumps(payload, ensure_ascii=False, indent=2, sort_keys=True) + "\n"
+        # Escrita atômica: uma execução interrompida não deixa o manifesto truncado
+        fd, tmp = tempfile.mkstemp(prefix=self.path.name + ".", suffix=".tmp", dir=self.path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(text)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def summary(self) -> dict:
+        return {
+            "ran": [name for name, _ in self.ran],
+            "skipped": [name for name, _ in self.skipped],
+            "seconds_ran": round(sum(s for _, s in self.ran), 6),
+            "seconds_saved": round(sum(s for _, s in self.skipped), 6),
+        }
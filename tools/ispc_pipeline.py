@@ -7,6 +7,8 @@ from pathlib import Path
 
 import pandas as pd
 
+from ispc_artifacts import MANIFEST_NAME, ArtifactManifest, code_sha256, file_sha256
+
 
 @dataclass(frozen=True)
 class ColumnSpec:
@@ -239,6 +241,61 @@ def build_reduction_report(pairs: list[dict], clusters: list[set[str]], depth: s
     return "\n".join(lines) + "\n"
 
 
+def records_suffix(args: argparse.Namespace) -> str:
+    if args.excel:
+        return args.sheet
+    suffix = Path(args.csv).stem
+    if suffix.startswith("ispc_records_"):
+        suffix = suffix[len("ispc_records_") :]
+    return suffix
+
+
+def build_records(args: argparse.Namespace) -> tuple[pd.DataFrame, str | None]:
+    depth = args.profundidade or parse_depth_from_sheet(args.sheet)
+
+    if args.excel:
+        excel_path = Path(args.excel)
+        df_raw = load_excel_sheet(excel_path, args.sheet)
+        df = standardize_from_excel(df_raw)
+
+        df.insert(0, "ano", args.ano if args.ano is not None else "")
+        df.insert(1, "profundidade_cm", depth if depth else "")
+        return df, depth
+
+    csv_path = Path(args.csv)
+    df_raw = load_csv(csv_path)
+
+    # Se o CSV já tiver ano/profundidade, preserva.
+    # Se não tiver, cria. Se tiver e o usuário passou --ano/--profundidade,
+    # preenche apenas valores vazios.
+    if "ano" not in df_raw.columns:
+        df_raw.insert(0, "ano", args.ano if args.ano is not None else "")
+    elif args.ano is not None:
+        df_raw["ano"] = df_raw["ano"].replace("", pd.NA).fillna(args.ano)
+
+    if "profundidade_cm" not in df_raw.columns:
+        df_raw.insert(1, "profundidade_cm", depth if depth else "")
+    elif depth:
+        df_raw["profundidade_cm"] = df_raw["profundidade_cm"].replace("", pd.NA).fillna(depth)
+
+    df = standardize_from_csv(df_raw)
+
+    # Re-anexar colunas de identificação no início
+    meta_cols = []
+    for meta in ["ano", "profundidade_cm"]:
+        if meta in df_raw.columns:
+            meta_cols.append(meta)
+    df = pd.concat([df_raw[meta_cols].copy(), df], axis=1)
+
+    # Se o CSV tiver profundidade única, usa no relatório
+    if "profundidade_cm" in df.columns:
+        vals = df["profundidade_cm"].dropna().astype(str)
+        uniq = sorted(set(v for v in vals.tolist() if v.strip() != ""))
+        if len(uniq) == 1 and not depth:
+            depth = uniq[0]
+    return df, depth
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Pipeline de organização e auditoria do banco ISPC.")
     parser.add_argument("--excel", type=str, help="Caminho para banco_dados.xlsx")
@@ -249,6 +306,7 @@ def main() -> None:
     parser.add_argument("--profundidade", type=str, default=None, help="Profundidade cm (opcional). Ex.: 0-10")
     parser.add_argument("--corr-method", type=str, default="pearson", choices=["pearson", "spearman"], help="Método")
     parser.add_argument("--corr-threshold", type=float, default=0.85, help="Limiar de |r|")
+    parser.add_argument("--force", action="store_true", help="Recalcula todos os estágios, ignorando o manifesto")
 
     args = parser.parse_args()
 
@@ -258,77 +316,122 @@ def main() -> None:
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    depth = args.profundidade or parse_depth_from_sheet(args.sheet)
+    manifest = ArtifactManifest(out_dir / MANIFEST_NAME, force=args.force)
+    source_path = Path(args.excel or args.csv)
+    suffix = records_suffix(args)
+    tag = f"{suffix}_{args.corr_method}_{args.corr_threshold:.2f}"
+    code = code_sha256(Path(__file__))
 
-    if args.excel:
-        excel_path = Path(args.excel)
-        df_raw = load_excel_sheet(excel_path, args.sheet)
-        df = standardize_from_excel(df_raw)
-        suffix = args.sheet
-
-        df.insert(0, "ano", args.ano if args.ano is not None else "")
-        df.insert(1, "profundidade_cm", depth if depth else "")
-    else:
-        csv_path = Path(args.csv)
-        df_raw = load_csv(csv_path)
-
-        # Se o CSV já tiver ano/profundidade, preserva.
-        # Se não tiver, cria. Se tiver e o usuário passou --ano/--profundidade,
-        # preenche apenas valores vazios.
-        if "ano" not in df_raw.columns:
-            df_raw.insert(0, "ano", args.ano if args.ano is not None else "")
-        elif args.ano is not None:
-            df_raw["ano"] = df_raw["ano"].replace("", pd.NA).fillna(args.ano)
-
-        if "profundidade_cm" not in df_raw.columns:
-            df_raw.insert(1, "profundidade_cm", depth if depth else "")
-        elif depth:
-            df_raw["profundidade_cm"] = df_raw["profundidade_cm"].replace("", pd.NA).fillna(depth)
-
-        df = standardize_from_csv(df_raw)
-
-        # Re-anexar colunas de identificação no início
-        meta_cols = []
-        for meta in ["ano", "profundidade_cm"]:
-            if meta in df_raw.columns:
-                meta_cols.append(meta)
-        df = pd.concat([df_raw[meta_cols].copy(), df], axis=1)
-
-        suffix = csv_path.stem
-        if suffix.startswith("ispc_records_"):
-            suffix = suffix[len("ispc_records_") :]
-
-        # Se o CSV tiver profundidade única, usa no relatório
-        if "profundidade_cm" in df.columns:
-            vals = df["profundidade_cm"].dropna().astype(str)
-            uniq = sorted(set(v for v in vals.tolist() if v.strip() != ""))
-            if len(uniq) == 1 and not depth:
-                depth = uniq[0]
     records_path = out_dir / f"ispc_records_{suffix}.csv"
-    df.to_csv(records_path, index=False, quoting=csv.QUOTE_MINIMAL)
-
-    minmax = compute_minmax(df)
     minmax_path = out_dir / f"ispc_minmax_{suffix}.json"
-    minmax_path.write_text(json.dumps(minmax, indent=2, ensure_ascii=False), encoding="utf-8")
-
-    corr = compute_correlations(df, method=args.corr_method)
     corr_path = out_dir / f"ispc_correlations_{suffix}_{args.corr_method}.csv"
-    corr.to_csv(corr_path)
-
-    pairs = high_corr_pairs(corr, threshold=args.corr_threshold)
-    pairs_path = out_dir / f"ispc_high_corr_pairs_{suffix}_{args.corr_method}_{args.corr_threshold:.2f}.csv"
-    pd.DataFrame(pairs).to_csv(pairs_path, index=False)
-
-    clusters = correlation_clusters(pairs)
-    report = build_reduction_report(pairs, clusters, depth, args.corr_method, args.corr_threshold)
-    report_path = out_dir / f"ispc_reduction_report_{suffix}_{args.corr_method}_{args.corr_threshold:.2f}.md"
-    report_path.write_text(report, encoding="utf-8")
-
-    print(f"OK: {records_path}")
-    print(f"OK: {minmax_path}")
-    print(f"OK: {corr_path}")
-    print(f"OK: {pairs_path}")
-    print(f"OK: {report_path}")
+    pairs_path = out_dir / f"ispc_high_corr_pairs_{tag}.csv"
+    report_path = out_dir / f"ispc_reduction_report_{tag}.md"
+
+    # Valores intermediários calculados sob demanda: só são carregados se
+    # algum estágio desatualizado precisar deles.
+    cache: dict = {}
+
+    def records() -> tuple[pd.DataFrame, str | None]:
+        if "records" not in cache:
+            cache["records"] = build_records(args)
+        return cache["records"]
+
+    def corr() -> pd.DataFrame:
+        if "corr" not in cache:
+            cache["corr"] = compute_correlations(records()[0], method=args.corr_method)
+        return cache["corr"]
+
+    def pairs() -> list[dict]:
+        if "pairs" not in cache:
+            cache["pairs"] = high_corr_pairs(corr(), threshold=args.corr_threshold)
+        return cache["pairs"]
+
+    def write_records() -> None:
+        records()[0].to_csv(records_path, index=False, quoting=csv.QUOTE_MINIMAL)
+
+    def write_minmax() -> None:
+        minmax = compute_minmax(records()[0])
+        minmax_path.write_text(json.dumps(minmax, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    def write_corr() -> None:
+        corr().to_csv(corr_path)
+
+    def write_pairs() -> None:
+        pd.DataFrame(pairs()).to_csv(pairs_path, index=False)
+
+    def write_report() -> None:
+        clusters = correlation_clusters(pairs())
+        report = build_reduction_report(pairs(), clusters, records()[1], args.corr_method, args.corr_threshold)
+        report_path.write_text(report, encoding="utf-8")
+
+    stages = [
+        (
+            f"pipeline:records:{suffix}",
+            lambda: {
+                "source": file_sha256(source_path),
+                "kind": "excel" if args.excel else "csv",
+                "sheet": args.sheet,
+                "ano": args.ano,
+                "profundidade": args.profundidade,
+                "code": code,
+            },
+            records_path,
+            write_records,
+        ),
+        (
+            f"pipeline:minmax:{suffix}",
+            lambda: {"records": file_sha256(records_path), "code": code},
+            minmax_path,
+            write_minmax,
+        ),
+        (
+            f"pipeline:correlations:{suffix}_{args.corr_method}",
+            lambda: {
+                "records": file_sha256(records_path),
+                "method": args.corr_method,
+                "code": code,
+            },
+            corr_path,
+            write_corr,
+        ),
+        (
+            f"pipeline:high_corr_pairs:{tag}",
+            lambda: {
+                "correlations": file_sha256(corr_path),
+                "threshold": args.corr_threshold,
+                "code": code,
+            },
+            pairs_path,
+            write_pairs,
+        ),
+        (
+            f"pipeline:reduction_report:{tag}",
+            lambda: {
+                # records entra por causa da profundidade inferida do CSV
+                "records": file_sha256(records_path),
+                "pairs": file_sha256(pairs_path),
+                "method": args.corr_method,
+                "threshold": args.corr_threshold,
+                "code": code,
+            },
+            report_path,
+            write_report,
+        ),
+    ]
+
+    # Os hashes de entrada de cada estágio dependem das saídas do anterior,
+    # por isso são avaliados somente depois que o estágio anterior rodou.
+    for name, inputs, path, build in stages:
+        ran = manifest.run(name, inputs(), [path], build)
+        print(f"{'OK' if ran else 'SKIP'}: {path}")
+
+    manifest.save()
+    summary = manifest.summary()
+    print(
+        f"Estágios: {len(summary['ran'])} recalculados, {len(summary['skipped'])} reaproveitados "
+        f"(~{summary['seconds_saved']:.3f}s economizados)"
+    )
 
 
 if __name__ == "__main__":
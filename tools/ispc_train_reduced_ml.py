@@ -6,6 +6,8 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 
+from ispc_artifacts import MANIFEST_NAME, ArtifactManifest, code_sha256, file_sha256
+
 
 REQUIRED_INPUTS_10 = [
     "dmg",
@@ -30,6 +32,9 @@ TARGETS_5 = [
 
 META_COLS = ["ano", "profundidade_cm", "parcela", "cultura"]
 
+# Colunas meta que podem definir folds agrupados (leave-one-group-out)
+CV_GROUP_COLS = ["ano", "parcela", "cultura"]
+
 
 @dataclass(frozen=True)
 class Standardization:
@@ -113,6 +118,93 @@ def _kfold_indices(n: int, k: int, seed: int) -> list[tuple[np.ndarray, np.ndarr
     return out
 
 
+def _group_fold_ids(groups: np.ndarray) -> np.ndarray:
+    # Leave-one-group-out: cada valor distinto (ano, parcela ou cultura) vira um fold.
+    # Linhas sem rótulo devem ser removidas antes (ver _labeled_mask).
+    _, fold_ids = np.unique(groups.astype(str), return_inverse=True)
+    return fold_ids.astype(int)
+
+
+def _labeled_mask(groups: pd.Series) -> np.ndarray:
+    return (groups.notna() & (groups.astype(str).str.strip() != "")).to_numpy()
+
+
+def _fold_ids_from_splits(n: int, splits: list[tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    fold_ids = np.empty(n, dtype=int)
+    for i, (_, test_idx) in enumerate(splits):
+        fold_ids[test_idx] = i
+    return fold_ids
+
+
+def _ridge_cv_scores(
+    X: np.ndarray,
+    y: np.ndarray,
+    fold_ids: np.ndarray,
+    alphas: list[float],
+    pooled: bool = False,
+) -> list[tuple[float, float] | None]:
+    """Cross-validated (RMSE, R2) of the ridge fit for each alpha.
+
+    The training Gram matrix and X^T y of each fold are the full-data totals
+    minus that fold's contribution, so the training slices are never
+    re-multiplied per fold or alpha; each alpha then solves all folds in a
+    single batched call.
+
+    With pooled=False the metrics are per-fold means (k-fold). With
+    pooled=True they are computed once over all held-out predictions, which
+    keeps small groups (e.g. one-row plots) from scoring a degenerate R2.
+    An alpha scores None when some fold's system is singular: alpha <= 0
+    with fewer training rows than coefficients, or collinear training data.
+    """
+    n = X.shape[0]
+    Xa = np.concatenate([np.ones((n, 1), dtype=float), X], axis=1)
+    p = Xa.shape[1]
+    n_folds = int(fold_ids.max()) + 1
+
+    gram_fold = np.zeros((n_folds, p, p), dtype=float)
+    np.add.at(gram_fold, fold_ids, Xa[:, :, None] * Xa[:, None, :])
+    xty_fold = np.zeros((n_folds, p), dtype=float)
+    np.add.at(xty_fold, fold_ids, Xa * y[:, None])
+
+    gram_train = (Xa.T @ Xa)[None] - gram_fold
+    xty_train = (Xa.T @ y)[None] - xty_fold
+
+    counts = np.bincount(fold_ids, minlength=n_folds).astype(float)
+    min_train_rows = n - int(counts.max())
+    y_mean = np.bincount(fold_ids, weights=y, minlength=n_folds) / counts
+    ss_tot = np.bincount(fold_ids, weights=(y - y_mean[fold_ids]) ** 2, minlength=n_folds)
+    ss_tot_pooled = float(np.sum((y - float(np.mean(y))) ** 2))
+
+    diag = np.arange(1, p)
+    scores: list[tuple[float, float] | None] = []
+    for alpha in alphas:
+        if alpha <= 0 and min_train_rows < p:
+            scores.append(None)
+            continue
+
+        lhs = gram_train.copy()
+        lhs[:, diag, diag] += alpha
+        try:
+            w = np.linalg.solve(lhs, xty_train[:, :, None])[..., 0]
+        except np.linalg.LinAlgError:
+            scores.append(None)
+            continue
+
+        # Cada linha é prevista pelo modelo do fold que a deixou de fora
+        yhat = np.einsum("ip,ip->i", Xa, w[fold_ids])
+        ss_res = np.bincount(fold_ids, weights=(yhat - y) ** 2, minlength=n_folds)
+
+        if pooled:
+            rmse = float(np.sqrt(np.sum(ss_res) / n))
+            r2 = 1.0 if ss_tot_pooled == 0 else 1.0 - float(np.sum(ss_res)) / ss_tot_pooled
+        else:
+            rmse = float(np.mean(np.sqrt(ss_res / counts)))
+            r2s = np.where(ss_tot == 0, 1.0, 1.0 - ss_res / np.where(ss_tot == 0, 1.0, ss_tot))
+            r2 = float(np.mean(r2s))
+        scores.append((rmse, r2))
+    return scores
+
+
 def train_one_target(
     df: pd.DataFrame,
     features: list[str],
@@ -120,9 +212,12 @@ def train_one_target(
     alphas: list[float],
     k: int,
     seed: int,
+    group_col: str | None = None,
 ) -> dict:
     sub = df[features + [target]].dropna()
-    if sub.empty or sub.shape[0] < max(10, k * 2):
+    # k só se aplica ao kfold; no esquema agrupado o número de folds vem dos grupos
+    min_rows = 10 if group_col else max(10, k * 2)
+    if sub.empty or sub.shape[0] < min_rows:
         return {
             "ok": False,
             "reason": "not_enough_rows",
@@ -132,26 +227,58 @@ def train_one_target(
     X, st = _standardize(sub, features)
     y = sub[target].to_numpy(dtype=float)
 
-    splits = _kfold_indices(X.shape[0], k=k, seed=seed)
+    if group_col:
+        # Linhas sem rótulo de grupo ficam fora da validação (não formam um
+        # grupo falso), mas continuam no ajuste final do modelo.
+        labels = df.loc[sub.index, group_col]
+        mask = _labeled_mask(labels)
+        X_cv, y_cv = X[mask], y[mask]
+        fold_ids = _group_fold_ids(labels[mask].to_numpy()) if mask.any() else np.zeros(0, dtype=int)
+        n_folds = int(fold_ids.max()) + 1 if fold_ids.size else 0
+        if n_folds < 2:
+            return {
+                "ok": False,
+                "reason": "not_enough_groups",
+                "n": int(sub.shape[0]),
+                "group": group_col,
+                "n_unlabeled": int((~mask).sum()),
+            }
+        cv_info: dict = {
+            "scheme": "group",
+            "group": group_col,
+            "k": n_folds,
+            "n": int(mask.sum()),
+            "n_unlabeled": int((~mask).sum()),
+            "metric": "pooled",
+        }
+    else:
+        splits = _kfold_indices(X.shape[0], k=k, seed=seed)
+        X_cv, y_cv = X, y
+        fold_ids = _fold_ids_from_splits(X.shape[0], splits)
+        cv_info = {"scheme": "kfold", "k": int(k), "seed": int(seed), "metric": "fold_mean"}
 
     best = None
-    for alpha in alphas:
-        rmses = []
-        r2s = []
-        for train_idx, test_idx in splits:
-            intercept, weights = _ridge_fit(X[train_idx], y[train_idx], alpha=alpha)
-            yhat = _predict(X[test_idx], intercept, weights)
-            rmses.append(_rmse(y[test_idx], yhat))
-            r2s.append(_r2(y[test_idx], yhat))
-        mean_rmse = float(np.mean(rmses))
-        mean_r2 = float(np.mean(r2s))
+    scores = _ridge_cv_scores(X_cv, y_cv, fold_ids, alphas, pooled=bool(group_col))
+    for alpha, score in zip(alphas, scores):
+        if score is None:
+            continue
+        mean_rmse, mean_r2 = score
         cand = (mean_rmse, -mean_r2, alpha)
         if best is None or cand < best[0]:
             best = (cand, mean_rmse, mean_r2)
 
-    assert best is not None
+    if best is None:
+        return {
+            "ok": False,
+            "reason": "singular_folds",
+            "n": int(sub.shape[0]),
+        }
+
     _, best_rmse, best_r2 = best
     best_alpha = float(best[0][2])
+    skipped_alphas = [float(a) for a, sc in zip(alphas, scores) if sc is None]
+    if skipped_alphas:
+        cv_info["skipped_alphas"] = skipped_alphas
 
     intercept, weights = _ridge_fit(X, y, alpha=best_alpha)
     yhat_train = _predict(X, intercept, weights)
@@ -160,7 +287,7 @@ def train_one_target(
         "ok": True,
         "n": int(X.shape[0]),
         "alpha": best_alpha,
-        "cv": {"k": int(k), "seed": int(seed), "rmse": best_rmse, "r2": best_r2},
+        "cv": {**cv_info, "rmse": best_rmse, "r2": best_r2},
         "train": {"rmse": _rmse(y, yhat_train), "r2": _r2(y, yhat_train)},
         "standardization": {"mean": st.mean, "std": st.std},
         "intercept": intercept,
@@ -181,7 +308,14 @@ def load_records(path: Path) -> pd.DataFrame:
     return df
 
 
-def train_for_tag(records_csv: Path, tag: str, alphas: list[float], k: int, seed: int) -> dict:
+def train_for_tag(
+    records_csv: Path,
+    tag: str,
+    alphas: list[float],
+    k: int,
+    seed: int,
+    group_col: str | None = None,
+) -> dict:
     df = load_records(records_csv)
 
     # manter somente linhas com a profundidade esperada quando disponível
@@ -200,6 +334,7 @@ def train_for_tag(records_csv: Path, tag: str, alphas: list[float], k: int, seed
             alphas=alphas,
             k=k,
             seed=seed,
+            group_col=group_col,
         )
 
     return {
@@ -221,6 +356,14 @@ def main() -> None:
     ap.add_argument("--alphas", type=str, default="0,0.01,0.1,1,10", help="Grid de alpha")
     ap.add_argument("--k", type=int, default=5, help="K-fold")
     ap.add_argument("--seed", type=int, default=42, help="Seed")
+    ap.add_argument(
+        "--cv",
+        type=str,
+        default="kfold",
+        choices=["kfold"] + CV_GROUP_COLS,
+        help="Esquema de validacao: kfold aleatorio ou leave-one-group-out por ano/parcela/cultura",
+    )
+    ap.add_argument("--force", action="store_true", help="Retreina mesmo se o manifesto indicar que nada mudou")
     ap.add_argument(
         "--out",
         type=str,
@@ -239,6 +382,7 @@ def main() -> None:
     data_dir = Path(args.data_dir)
     tags = [t.strip() for t in str(args.tags).split(",") if t.strip()]
     alphas = [float(a.strip()) for a in str(args.alphas).split(",") if a.strip()]
+    group_col = None if args.cv == "kfold" else args.cv
 
     out = {
         "kind": "ispc_reduced_ridge",
@@ -247,19 +391,28 @@ def main() -> None:
         "by_tag": {},
     }
 
+    out_path = Path(args.out)
+    js_path = Path(str(args.out_js)) if args.out_js else None
+    outputs = [out_path] + ([js_path] if js_path else [])
+
+    records_by_tag: dict[str, Path] = {}
     for tag in tags:
         records_csv = data_dir / f"ispc_records_{tag}.csv"
         if not records_csv.exists():
             raise SystemExit(f"Nao achei {records_csv}")
-        out["by_tag"][tag] = train_for_tag(records_csv, tag=tag, alphas=alphas, k=args.k, seed=args.seed)
+        records_by_tag[tag] = records_csv
+
+    def build() -> None:
+        for tag, records_csv in records_by_tag.items():
+            out["by_tag"][tag] = train_for_tag(
+                records_csv, tag=tag, alphas=alphas, k=args.k, seed=args.seed, group_col=group_col
+            )
 
-        out_path = Path(args.out)
         out_path.parent.mkdir(parents=True, exist_ok=True)
         out_json = json.dumps(out, ensure_ascii=False, indent=2)
         out_path.write_text(out_json, encoding="utf8")
 
-        if args.out_js:
-            js_path = Path(str(args.out_js))
+        if js_path:
             js_path.parent.mkdir(parents=True, exist_ok=True)
             payload = json.dumps(out, ensure_ascii=False, separators=(",", ":"))
             js = (
@@ -276,7 +429,29 @@ def main() -> None:
             )
             js_path.write_text(js, encoding="utf8")
 
-        print(json.dumps({"ok": True, "out": str(out_path), "outJs": args.out_js}, ensure_ascii=False, indent=2))
+    manifest = ArtifactManifest(data_dir / MANIFEST_NAME, force=args.force)
+    inputs: dict = {
+        "records": {tag: file_sha256(p) for tag, p in records_by_tag.items()},
+        "alphas": alphas,
+        "cv": args.cv,
+        "code": code_sha256(Path(__file__)),
+    }
+    # k e seed só definem os folds no kfold; nos esquemas agrupados são ignorados
+    if group_col is None:
+        inputs["k"] = args.k
+        inputs["seed"] = args.seed
+
+    stage = f"train_reduced_ml:{','.join(tags)}:{args.cv}:{out_path.as_posix()}"
+    ran = manifest.run(stage, inputs, outputs, build)
+    manifest.save()
+
+    print(
+        json.dumps(
+            {"ok": True, "out": str(out_path), "outJs": args.out_js, "skipped": not ran, "manifest": manifest.summary()},
+            ensure_ascii=False,
+            indent=2,
+        )
+    )
 
 
 if __name__ == "__main__":